@@ -1,25 +1,37 @@
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from functools import lru_cache
 import uvicorn
+import asyncio
 import uuid
 import os
 from datetime import datetime, timedelta
 from fastapi.security import APIKeyHeader
-from starlette.requests import Request
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
+import fitz
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document, SystemMessage, HumanMessage
 from langchain_community.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.question_answering import load_qa_chain
 import openai
-import tempfile
 import logging
-from openai import OpenAI
+import hashlib
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+import faiss
+import numpy as np
+import redis.asyncio as redis
+from openai import AsyncOpenAI
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,7 +41,10 @@ load_dotenv()
 # Initialize OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-app = FastAPI()
+DEBUG = os.getenv('DEBUG', 'false').lower() in ('1', 'true', 'yes')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,129 +55,321 @@ app.add_middleware(
 )
 
 class SessionManager:
-    def __init__(self, session_timeout_minutes: int = 30):
-        self.sessions: Dict[str, dict] = {}
+    """Session state lives in Redis so every uvicorn worker sees the same sessions.
+
+    Only plain data is stored, as fields of the ``sess:{id}`` hash: ``created_at``,
+    one ``quiz:{quiz_id}`` JSON field per quiz and one ``answer:{quiz_id}:{question_id}``
+    field per answer. Writers only touch their own fields, so concurrent requests
+    cannot overwrite each other's updates.
+    """
+    def __init__(self, redis_url: str, session_timeout_minutes: int = 30):
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True)
         self.session_timeout = timedelta(minutes=session_timeout_minutes)
-        
-    def create_session(self) -> str:
+
+    def _key(self, session_id: str) -> str:
+        return f"sess:{session_id}"
+
+    async def _set_field(self, session_id: str, field: str, value: str):
+        # HSET updates a single field atomically; the TTL is refreshed in the same transaction
+        key = self._key(session_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, field, value)
+            pipe.expire(key, self.session_timeout)
+            await pipe.execute()
+
+    async def create_session(self) -> str:
         session_id = str(uuid.uuid4())
-        self.sessions[session_id] = {
-            'created_at': datetime.now(),
-            'last_accessed': datetime.now(),
-            'chain': None,
-            'memory': ConversationBufferMemory(memory_key='chat_history', return_messages=True),
-            'active_quizzes': {}
-        }
+        await self._set_field(session_id, 'created_at', datetime.now().isoformat())
         return session_id
     
-    def get_session(self, session_id: str) -> Optional[dict]:
-        session = self.sessions.get(session_id)
-        if session:
-            if datetime.now() - session['last_accessed'] > self.session_timeout:
-                del self.sessions[session_id]
-                return None
-            session['last_accessed'] = datetime.now()
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        stored = await self.redis.hgetall(self._key(session_id))
+        # A late write can recreate an expired hash without its created_at; treat it as gone
+        if 'created_at' not in stored:
+            return None
+        quizzes = {}
+        answers = {}
+        for field, value in stored.items():
+            kind, _, rest = field.partition(':')
+            if kind == 'quiz':
+                quiz = json.loads(value)
+                questions = [Question(**q) for q in quiz["questions"]]
+                quizzes[rest] = {
+                    "questions": questions,
+                    "id_set": frozenset(q.id for q in questions),
+                    "current_question": quiz["current_question"]
+                }
+            elif kind == 'answer':
+                quiz_id, _, question_id = rest.partition(':')
+                answers.setdefault(quiz_id, {})[question_id] = value
+        for quiz_id, quiz in quizzes.items():
+            quiz["answers"] = answers.get(quiz_id, {})
+        session = {
+            'created_at': datetime.fromisoformat(stored['created_at']),
+            'last_accessed': datetime.now(),
+            'active_quizzes': quizzes
+        }
+        # Sliding expiration: every access pushes the TTL out again
+        await self.redis.expire(self._key(session_id), self.session_timeout)
         return session
-    
-    def cleanup_expired_sessions(self):
-        current_time = datetime.now()
-        expired_sessions = [
-            sid for sid, session in self.sessions.items()
-            if current_time - session['last_accessed'] > self.session_timeout
-        ]
-        for sid in expired_sessions:
-            del self.sessions[sid]
 
-session_manager = SessionManager()
+    async def save_quiz(self, session_id: str, quiz_id: str, quiz: dict):
+        """Write one quiz's questions; its answers live in their own fields and are left alone"""
+        await self._set_field(session_id, f"quiz:{quiz_id}", json.dumps({
+            "questions": [asdict(q) for q in quiz["questions"]],
+            "current_question": quiz["current_question"]
+        }))
+
+    async def save_answer(self, session_id: str, quiz_id: str, question_id: str, answer: str):
+        await self._set_field(session_id, f"answer:{quiz_id}:{question_id}", answer)
+
+session_manager = SessionManager(REDIS_URL)
 
 API_KEY_HEADER = APIKeyHeader(name="X-Session-ID", auto_error=False)
 
 async def get_session(session_id: Optional[str] = Depends(API_KEY_HEADER)) -> dict:
     if not session_id:
-        session_id = session_manager.create_session()
+        session_id = await session_manager.create_session()
     
-    session = session_manager.get_session(session_id)
+    session = await session_manager.get_session(session_id)
     if not session:
-        session_id = session_manager.create_session()
-        session = session_manager.get_session(session_id)
+        session_id = await session_manager.create_session()
+        session = await session_manager.get_session(session_id)
     
     return {'session_id': session_id, 'data': session}
 
 class QuizAnswer(BaseModel):
+    quiz_id: str
     question_id: str
     user_answer: str
 
-class Question(BaseModel):
+# Internal type created per generated question; FastAPI still serializes it in responses
+@dataclass(slots=True, frozen=True)
+class Question:
     id: str
     question: str
     ideal_answer: Optional[str] = None
 
 SYSTEM_MESSAGE = os.getenv('OPENAI_SYSTEM_MESSAGE', 'You are a helpful AI assistant specializing in document analysis.')
-CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 1000))
-CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 200))
+# Chunk size and overlap are measured in tokens
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 500))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 50))
 MODEL_NAME = os.getenv('MODEL_NAME', 'gpt-4-turbo-preview')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', 512))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 1000))
 PDF_PATHS = [
     os.path.join('data', "Ilesh Sir (IK) - Words.pdf"),
     os.path.join('data', "UBIK SOLUTION.pdf"),
     os.path.join('data', "illesh3.pdf"),
     os.path.join('data', "website-data-ik.pdf"),
 ]
+# Below this many chunks a flat index is used; PQ training needs a few hundred vectors
+IVFPQ_MIN_CHUNKS = int(os.getenv('IVFPQ_MIN_CHUNKS', 1024))
+IVFPQ_M = int(os.getenv('IVFPQ_M', 16))
+IVFPQ_NBITS = int(os.getenv('IVFPQ_NBITS', 8))
+IVFPQ_NPROBE = int(os.getenv('IVFPQ_NPROBE', 16))
+FAISS_OMP_THREADS = int(os.getenv('FAISS_OMP_THREADS', os.cpu_count() or 1))
+WARM_DOCS_K = int(os.getenv('WARM_DOCS_K', 4))
+WARM_DOCS_MAX_QUESTIONS = int(os.getenv('WARM_DOCS_MAX_QUESTIONS', 4096))
+QUIZ_CACHE_THRESHOLD = float(os.getenv('QUIZ_CACHE_THRESHOLD', 0.95))
+QUIZ_CACHE_TTL = int(os.getenv('QUIZ_CACHE_TTL', 600))
+QUIZ_CACHE_SIZE = int(os.getenv('QUIZ_CACHE_SIZE', 64))
+FAISS_INDEX_PATH = os.path.join('data', 'faiss_index')
+FAISS_META_PATH = os.path.join(FAISS_INDEX_PATH, 'meta.json')
 
 global_vectorstore = None
 
+# Documents retrieved ahead of time for quiz questions, keyed by question id.
+# Kept per process: a miss on another worker just falls back to retrieval.
+warm_docs: "OrderedDict[str, List[Document]]" = OrderedDict()
+background_tasks = set()
+
 def get_pdf_text(pdf_path: str) -> str:
-    reader = PdfReader(pdf_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() or ""
-    return text
+    with fitz.open(pdf_path) as doc:
+        return "".join(page.get_text("text") for page in doc)
 
 def get_text_chunks(text: str) -> List[str]:
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        model_name=EMBEDDING_MODEL,
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
-        length_function=len
+        separators=["\n\n", "\n", ". ", " ", ""]
     )
     return text_splitter.split_text(text)
 
+def get_pdf_chunks(pdf_path: str) -> List[str]:
+    return get_text_chunks(get_pdf_text(pdf_path))
+
+def iter_chunks():
+    """Yield chunks PDF by PDF so the combined text of all PDFs is never built"""
+    # Text extraction is CPU-bound, so parse the PDFs in separate processes
+    with ProcessPoolExecutor(max_workers=min(4, len(PDF_PATHS))) as executor:
+        for chunks in executor.map(get_pdf_chunks, PDF_PATHS):
+            yield from chunks
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    # One shared client for indexing, warm-up and the quiz cache.
+    # chunk_size is the number of texts sent per embeddings request, not a token window
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,
+        chunk_size=EMBEDDING_BATCH_SIZE,
+        max_retries=6,
+        request_timeout=30,
+        show_progress_bar=False
+    )
+
+def build_vectorstore(text_chunks: List[str], embeddings: OpenAIEmbeddings) -> FAISS:
+    vectors = embeddings.embed_documents(text_chunks)
+    if len(text_chunks) < IVFPQ_MIN_CHUNKS:
+        return FAISS.from_embeddings(list(zip(text_chunks, vectors)), embeddings)
+
+    vecs = np.array(vectors, dtype='float32')
+    d = vecs.shape[1]
+    nlist = min(4096, int(4 * math.sqrt(len(vecs))))
+    quantizer = faiss.IndexFlatL2(d)
+    index = faiss.IndexIVFPQ(quantizer, d, nlist, IVFPQ_M, IVFPQ_NBITS)
+    index.train(vecs)
+    index.add(vecs)
+    index.nprobe = IVFPQ_NPROBE
+
+    doc_ids = [str(uuid.uuid4()) for _ in text_chunks]
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore({
+            doc_id: Document(page_content=text)
+            for doc_id, text in zip(doc_ids, text_chunks)
+        }),
+        index_to_docstore_id=dict(enumerate(doc_ids))
+    )
+
+def get_index_key() -> str:
+    hasher = hashlib.sha256()
+    for path in PDF_PATHS:
+        with open(path, 'rb') as f:
+            hasher.update(f.read())
+    hasher.update(f"tiktoken{CHUNK_SIZE}{CHUNK_OVERLAP}{EMBEDDING_MODEL}{EMBEDDING_DIMENSIONS}".encode())
+    hasher.update(f"ivfpq|{IVFPQ_MIN_CHUNKS}|{IVFPQ_M}|{IVFPQ_NBITS}|{IVFPQ_NPROBE}".encode())
+    return hasher.hexdigest()
+
+def load_cached_vectorstore(key: str):
+    try:
+        with open(FAISS_META_PATH) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('key') != key:
+        return None
+    try:
+        return FAISS.load_local(
+            FAISS_INDEX_PATH,
+            get_embeddings(),
+            allow_dangerous_deserialization=True
+        )
+    except Exception as e:
+        logger.warning(f"Could not load cached FAISS index: {str(e)}")
+        return None
+
 def initialize_vectorstore():
     global global_vectorstore
     if global_vectorstore is not None:
         return
 
-    combined_text = ""
-    for path in PDF_PATHS:
-        combined_text += get_pdf_text(path) + " "
-    
-    text_chunks = get_text_chunks(combined_text)
-    global_vectorstore = FAISS.from_texts(
-        texts=text_chunks,
-        embedding=OpenAIEmbeddings()
-    )
+    key = get_index_key()
+    global_vectorstore = load_cached_vectorstore(key)
+    if global_vectorstore is not None:
+        logger.info("Loaded FAISS index from disk")
+        return
 
-def create_chain(session_data: dict):
-    if global_vectorstore is None:
-        raise Exception("Vectorstore not initialized")
+    # Drop duplicate chunks (e.g. text repeated across PDFs) before embedding
+    text_chunks = list(dict.fromkeys(iter_chunks()))
+    global_vectorstore = build_vectorstore(text_chunks, get_embeddings())
+    global_vectorstore.save_local(FAISS_INDEX_PATH)
+    with open(FAISS_META_PATH, 'w') as f:
+        json.dump({'key': key}, f)
 
-    chat_llm = ChatOpenAI(
-        model=MODEL_NAME,
-        temperature=0.7
-    )
+class FaissSemanticCache:
+    """Maps prompts to previously generated answers by cosine similarity of their embeddings.
 
-    session_data['chain'] = ConversationalRetrievalChain.from_llm(
-        llm=chat_llm,
-        retriever=global_vectorstore.as_retriever(),
-        memory=session_data['memory']
-    )
+    Entries expire after ``ttl`` seconds and at most ``max_size`` are kept.
+    """
+    def __init__(self, threshold: float, ttl: int, max_size: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.index = None
+        self.entries: List[tuple] = []  # (vector, answer, stored_at), in index order
+        self.vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
 
-def generate_questions(chain, num_questions: int = 5) -> List[Question]:
-    prompt = f"{SYSTEM_MESSAGE}\n\nGenerate {num_questions} questions about Ubik Solutions and their products/services. Make questions that test understanding of key concepts and details."
-    response = chain({'question': prompt})
-    answer_text = response.get('answer', '')
-    
-    # Split the response into individual questions
-    question_lines = [line.strip() for line in answer_text.split('\n') if line.strip()]
+    async def _embed(self, prompt: str) -> np.ndarray:
+        # Prompts repeat verbatim, so only the first lookup pays for an embeddings call
+        vector = self.vectors.get(prompt)
+        if vector is None:
+            vector = np.array([await get_embeddings().aembed_query(prompt)], dtype='float32')
+            faiss.normalize_L2(vector)
+            self.vectors[prompt] = vector
+            if len(self.vectors) > self.max_size:
+                self.vectors.popitem(last=False)
+        else:
+            self.vectors.move_to_end(prompt)
+        return vector
+
+    def _rebuild(self, entries: List[tuple]):
+        self.entries = entries
+        self.index = None
+        if entries:
+            self.index = faiss.IndexFlatIP(entries[0][0].shape[1])
+            self.index.add(np.vstack([vector for vector, _, _ in entries]))
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        live = [entry for entry in self.entries if entry[2] >= cutoff]
+        if len(live) < len(self.entries):
+            self._rebuild(live)
+
+    async def lookup(self, prompt: str) -> Optional[List[str]]:
+        self._expire()
+        if self.index is None:
+            return None
+        scores, ids = self.index.search(await self._embed(prompt), 1)
+        if scores[0][0] >= self.threshold:
+            return self.entries[ids[0][0]][1]
+        return None
+
+    async def store(self, prompt: str, answer: List[str]):
+        vector = await self._embed(prompt)
+        self._expire()
+        self._rebuild((self.entries + [(vector, answer, time.monotonic())])[-self.max_size:])
+
+question_cache = FaissSemanticCache(QUIZ_CACHE_THRESHOLD, QUIZ_CACHE_TTL, QUIZ_CACHE_SIZE)
+
+def get_questions_prompt(num_questions: int) -> str:
+    return f"Generate {num_questions} questions about Ubik Solutions and their products/services. Make questions that test understanding of key concepts and details."
+
+async def get_questions_messages(prompt: str) -> list:
+    # Quiz generation has no chat history to condense, so retrieve and answer in a single LLM call
+    docs = await global_vectorstore.as_retriever().aget_relevant_documents(prompt)
+    context = "\n\n".join(doc.page_content for doc in docs)
+    # The system text stays a fixed first message so OpenAI's prompt-prefix cache can hit across calls
+    return [
+        SystemMessage(content=SYSTEM_MESSAGE),
+        HumanMessage(content=f"{prompt}\n\nContext:\n{context}")
+    ]
+
+async def generate_questions(num_questions: int = 5) -> List[Question]:
+    prompt = get_questions_prompt(num_questions)
+    question_lines = await question_cache.lookup(prompt)
+    if question_lines is None:
+        chat_llm = ChatOpenAI(model=MODEL_NAME, temperature=0.7)
+        response = await chat_llm.ainvoke(await get_questions_messages(prompt))
+        answer_text = response.content
+        
+        # Split the response into individual questions
+        question_lines = [line.strip() for line in answer_text.split('\n') if line.strip()]
+        await question_cache.store(prompt, question_lines)
     questions = []
     
     for line in question_lines:
@@ -175,14 +382,83 @@ def generate_questions(chain, num_questions: int = 5) -> List[Question]:
     
     return questions[:num_questions]
 
+async def stream_questions(num_questions: int = 5):
+    """Yield questions one by one as their lines complete in the LLM output"""
+    prompt = get_questions_prompt(num_questions)
+    cached_lines = await question_cache.lookup(prompt)
+    if cached_lines is not None:
+        for line in cached_lines[:num_questions]:
+            yield Question(id=str(uuid.uuid4()), question=line)
+        return
+
+    chat_llm = ChatOpenAI(model=MODEL_NAME, temperature=0.7, streaming=True)
+    buffer = ""
+    question_lines = []
+    async for chunk in chat_llm.astream(await get_questions_messages(prompt)):
+        buffer += chunk.content
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            if line.strip():
+                question_lines.append(line.strip())
+                if len(question_lines) <= num_questions:
+                    yield Question(id=str(uuid.uuid4()), question=line.strip())
+    if buffer.strip():
+        question_lines.append(buffer.strip())
+        if len(question_lines) <= num_questions:
+            yield Question(id=str(uuid.uuid4()), question=buffer.strip())
+    await question_cache.store(prompt, question_lines)
+
+async def warm_questions(questions: List[Question]):
+    # One embeddings request and one index.search over the whole query matrix,
+    # which lets FAISS batch the distance computation instead of N single searches
+    vectors = await get_embeddings().aembed_documents([q.question for q in questions])
+    scores, ids = await asyncio.to_thread(
+        global_vectorstore.index.search, np.array(vectors, dtype='float32'), WARM_DOCS_K
+    )
+    for question, row in zip(questions, ids):
+        warm_docs[question.id] = [
+            global_vectorstore.docstore.search(global_vectorstore.index_to_docstore_id[i])
+            for i in row if i != -1
+        ]
+    while len(warm_docs) > WARM_DOCS_MAX_QUESTIONS:
+        warm_docs.popitem(last=False)
+
+def schedule_warm(questions: List[Question]):
+    """Prefetch evaluation context in the background while the user answers"""
+    if not questions:
+        return
+    task = asyncio.create_task(warm_questions(questions))
+    background_tasks.add(task)
+    task.add_done_callback(warm_done)
+
+def warm_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Error warming question context: {task.exception()!r}")
+
+async def get_question_docs(question: Question) -> List[Document]:
+    docs = warm_docs.get(question.id)
+    if docs is None:
+        docs = await global_vectorstore.asimilarity_search(question.question, k=WARM_DOCS_K)
+    return docs
+
+async def evaluate_answer(qa_chain, question: Question, user_answer: str) -> str:
+    docs = await get_question_docs(question)
+    response = await qa_chain.acall({
+        'input_documents': docs,
+        'question': f"Question: {question.question}\nUser's answer: {user_answer}\n\nEvaluate whether the user's answer is correct based on the context and briefly explain."
+    })
+    return response.get('output_text', '').strip()
+
 @app.on_event("startup")
 async def startup_event():
+    faiss.omp_set_num_threads(FAISS_OMP_THREADS)
     initialize_vectorstore()
 
 
 
 # Initialize the client once at the module level
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 @app.post("/transcribe-audio")
 async def transcribe_audio(
@@ -190,22 +466,15 @@ async def transcribe_audio(
     session: dict = Depends(get_session)
 ):
     try:
-        # Create a temporary file to store the uploaded audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_audio:
-            # Write the uploaded file content to temporary file
-            content = await audio_file.read()
-            temp_audio.write(content)
-            temp_audio.flush()
-            
-            # Open the file and send to Whisper API using new client format
-            with open(temp_audio.name, 'rb') as audio:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio
-                )
-        
-        # Clean up temporary file
-        os.unlink(temp_audio.name)
+        # Hand the spooled upload straight to Whisper, no tempfile round-trip
+        transcript = await client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(
+                audio_file.filename or "audio.webm",
+                audio_file.file,
+                audio_file.content_type or "audio/webm"
+            )
+        )
         
         return {"text": transcript.text}
         
@@ -218,17 +487,18 @@ async def transcribe_audio(
 @app.post("/quiz/start")
 async def start_quiz(session: dict = Depends(get_session)):
     session_data = session['data']
-    if not session_data.get('chain'):
-        create_chain(session_data)
     
     quiz_id = str(uuid.uuid4())
-    questions = generate_questions(session_data['chain'])
+    questions = await generate_questions()
     
     session_data['active_quizzes'][quiz_id] = {
         "questions": questions,
+        "id_set": frozenset(q.id for q in questions),
         "answers": {},
         "current_question": 0
     }
+    await session_manager.save_quiz(session['session_id'], quiz_id, session_data['active_quizzes'][quiz_id])
+    schedule_warm(questions)
     
     return {
         "session_id": session['session_id'],
@@ -236,19 +506,58 @@ async def start_quiz(session: dict = Depends(get_session)):
         "questions": questions
     }
 
+@app.post("/quiz/start/stream")
+async def start_quiz_stream(session: dict = Depends(get_session)):
+    """Server-sent events variant of /quiz/start that emits each question as soon as it is generated"""
+    session_data = session['data']
+
+    quiz_id = str(uuid.uuid4())
+    quiz = {
+        "questions": [],
+        "id_set": set(),
+        "answers": {},
+        "current_question": 0
+    }
+    session_data['active_quizzes'][quiz_id] = quiz
+    # Register the quiz before any question goes out so answers are accepted mid-stream
+    await session_manager.save_quiz(session['session_id'], quiz_id, quiz)
+
+    async def event_stream():
+        yield f"event: quiz\ndata: {json.dumps({'session_id': session['session_id'], 'quiz_id': quiz_id})}\n\n"
+        try:
+            async for question in stream_questions():
+                quiz["questions"].append(question)
+                quiz["id_set"].add(question.id)
+                await session_manager.save_quiz(session['session_id'], quiz_id, quiz)
+                yield f"event: question\ndata: {json.dumps(asdict(question))}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming quiz questions: {str(e)}")
+            yield "event: error\ndata: {}\n\n"
+            return
+        schedule_warm(quiz["questions"])
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/quiz/answer")
-async def submit_answer(request: Request):
+async def submit_answer(answer: QuizAnswer, session: dict = Depends(get_session)):
     try:
-        # Get the raw JSON data from request
-        data = await request.json()
-        
-        logger.info(f"Received answer data: {data}")
+        logger.info(f"Received answer data: {answer}")
+
+        # Record the answer only when it belongs to a known quiz question
+        quiz = session['data']['active_quizzes'].get(answer.quiz_id)
+        if not quiz or answer.question_id not in quiz["id_set"]:
+            return {
+                "status": "error",
+                "message": "Unknown quiz or question"
+            }
+        await session_manager.save_answer(session['session_id'], answer.quiz_id, answer.question_id, answer.user_answer)
         
         # Return success response with minimal processing
         return {
             "status": "success",
             "quiz_complete": False,  # You can modify this based on your needs
-            "received_data": data
+            "received_data": answer
         }
     except Exception as e:
         logger.error(f"Error processing answer: {str(e)}")
@@ -264,18 +573,22 @@ async def get_quiz_result(quiz_id: str, session: dict = Depends(get_session)):
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found")
     
-    # Get the chain to evaluate answers
-    if not session_data.get('chain'):
-        create_chain(session_data)
+    # Evaluate answered questions concurrently against their prefetched context
+    qa_chain = load_qa_chain(ChatOpenAI(model=MODEL_NAME, temperature=0), chain_type="stuff")
+    answered = [q for q in quiz["questions"] if q.id in quiz["answers"]]
+    evaluations = await asyncio.gather(*(
+        evaluate_answer(qa_chain, q, quiz["answers"][q.id]) for q in answered
+    ))
+    evaluation_by_id = dict(zip((q.id for q in answered), evaluations))
     
     evaluated_answers = []
     
     for question in quiz["questions"]:
         user_answer = quiz["answers"].get(question.id, "No answer provided")
-        # You could add AI evaluation of answers here if desired
         evaluated_answers.append({
             "question": question.question,
             "user_answer": user_answer,
+            "evaluation": evaluation_by_id.get(question.id),
         })
     
     return {
@@ -285,7 +598,11 @@ async def get_quiz_result(quiz_id: str, session: dict = Depends(get_session)):
         "answered_questions": len(quiz["answers"])
     }
 
-@app.get("/debug/session")
+def require_debug():
+    if not DEBUG:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/debug/session", dependencies=[Depends(require_debug)])
 async def debug_session(session: dict = Depends(get_session)):
     """Debug endpoint to view current session state"""
     session_data = session['data']
@@ -295,7 +612,7 @@ async def debug_session(session: dict = Depends(get_session)):
             quiz_id: {
                 "current_question": quiz["current_question"],
                 "total_questions": len(quiz["questions"]),
-                "answered_questions": list(quiz["answers"].keys()),
+                "answered_questions": tuple(quiz["answers"]),
             }
             for quiz_id, quiz in session_data.get('active_quizzes', {}).items()
         }
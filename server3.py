@@ -3,28 +3,38 @@ import uuid
 import time
 import logging
 import threading
+import asyncio
 from datetime import datetime
+from collections import OrderedDict
 from functools import lru_cache
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import base64
-import requests
+import hashlib
+import json
+import importlib.util
+import httpx
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from fastapi import FastAPI, File, UploadFile, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import speech_recognition as sr
 from dotenv import load_dotenv
 from openai import OpenAI
 
-from pypdf import PdfReader
+import fitz
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+import faiss
+import numpy as np
 from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
 from langchain.prompts import PromptTemplate
 from langchain.chains.question_answering import load_qa_chain
+from langchain.callbacks.base import AsyncCallbackHandler
 
 load_dotenv()
 
@@ -35,6 +45,21 @@ CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 1000))
 CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 200))
 MODEL_NAME = os.getenv('MODEL_NAME', 'gpt-3.5-turbo')
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+MAX_USER_SESSIONS = int(os.getenv('MAX_USER_SESSIONS', 1024))
+USER_SESSION_TTL = int(os.getenv('USER_SESSION_TTL', 3600))
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 4096))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 60))
+# Whether an answer served from the cache is sent to FORWARD_ENDPOINT again
+FORWARD_CACHED_ANSWERS = os.getenv('FORWARD_CACHED_ANSWERS', 'true').lower() in ('1', 'true', 'yes')
+FORWARD_WINDOW_CHARS = int(os.getenv('FORWARD_WINDOW_CHARS', 200))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 256))
+# Approximate index settings: HNSW for small corpora, IVF once there is enough data to train it
+HNSW_M = int(os.getenv('HNSW_M', 32))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 64))
+IVF_NLIST = int(os.getenv('IVF_NLIST', 64))
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', 8))
+FAISS_INDEX_PATH = os.path.join('data', f'faiss_index_{EMBEDDING_MODEL}')
+FAISS_META_PATH = os.path.join(FAISS_INDEX_PATH, 'meta.json')
 
 # Default system message
 DEFAULT_SYSTEM_MESSAGE = """strictly answer in english and dont go out of the context that is provided to u but please cosider that there will be major speeech recognition errors so please work accordingly, You are a helpful AI assistant with access to UBIK Solutions. 
@@ -50,10 +75,83 @@ logger = logging.getLogger(__name__)
 
 executor = ThreadPoolExecutor(max_workers=3)
 
+# Shared keep-alive client for Google APIs and the forward endpoint; closed on shutdown.
+# HTTP/2 needs the optional h2 package (httpx[http2]); without it httpx stays on HTTP/1.1
+http_client = httpx.AsyncClient(
+    http2=importlib.util.find_spec("h2") is not None,
+    timeout=30,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+
 global_vectorstore = None
 vectorstore_lock = threading.Lock()
 
-user_sessions = {}
+class LRUCache:
+    """Dict-like store that evicts the least recently used entry once max_size is
+    exceeded and drops entries left untouched for more than ttl seconds.
+
+    With refresh_on_read=False reads leave entries alone, so each one expires ttl
+    seconds after it was stored and eviction falls back to insertion order.
+
+    All operations are synchronous and only run on the event loop thread, so
+    they cannot interleave with each other and need no lock.
+    """
+    def __init__(self, max_size: int, ttl: int, refresh_on_read: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_on_read = refresh_on_read
+        self._data = OrderedDict()  # key -> (value, last access or store time)
+
+    def _expire(self):
+        now = time.monotonic()
+        # Entries are kept in access order, so expired ones are all at the front
+        while self._data:
+            key, (_, accessed) = next(iter(self._data.items()))
+            if now - accessed <= self.ttl:
+                break
+            self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        self._expire()
+        return key in self._data
+
+    def __getitem__(self, key):
+        self._expire()
+        value, _ = self._data[key]
+        if self.refresh_on_read:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        self._expire()
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def discard_where(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+user_sessions = LRUCache(max_size=MAX_USER_SESSIONS, ttl=USER_SESSION_TTL)
+
+# Recent /ask answers keyed by (user_id, system message, normalized question), for repeated voice input.
+# Hits do not extend the TTL, so a repeated question reaches the chain again once it expires.
+answer_cache = LRUCache(max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, refresh_on_read=False)
 
 app = FastAPI()
 
@@ -65,11 +163,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Event lines are queued here and appended to app_logs.txt by a single background writer
+log_queue: asyncio.Queue = asyncio.Queue()
+log_writer_task = None
+
 def log_event(event_type: str, details: str = "", user_id: str = "Unknown"):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_line = f"{timestamp} | {event_type} | UserID: {user_id} | {details}\n"
+    log_queue.put_nowait(log_line)
+
+def _drain_log_queue(lines: list) -> list:
+    while not log_queue.empty():
+        lines.append(log_queue.get_nowait())
+    return lines
+
+def _append_log_lines(lines: list):
     with open("app_logs.txt", "a", encoding="utf-8") as f:
-        f.write(log_line)
+        f.write("".join(lines))
+
+async def write_log_events():
+    # Everything queued while the previous batch was being written goes out in one write
+    while True:
+        lines = _drain_log_queue([await log_queue.get()])
+        await asyncio.to_thread(_append_log_lines, lines)
 
 def get_user_state(user_id: str):
     if user_id not in user_sessions:
@@ -85,14 +201,10 @@ def get_user_state(user_id: str):
         log_event("UserJoined", "New user state created.", user_id=user_id)
     return user_sessions[user_id]
 
-@lru_cache(maxsize=128)
 def get_pdf_text(pdf_path: str) -> str:
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
+        with fitz.open(pdf_path) as doc:
+            return "\n".join(page.get_text("text") for page in doc)
     except Exception as e:
         logger.error(f"Error reading {pdf_path}: {e}")
         return ""
@@ -106,11 +218,13 @@ def get_text_chunks(text: str):
     )
     return text_splitter.split_text(text)
 
+def _extract_pdf_chunks(pdf_path: str):
+    return get_text_chunks(get_pdf_text(pdf_path))
+
 import os
 import uuid
 import json
 import base64
-import aiohttp
 import logging
 from fastapi import UploadFile
 from fastapi.responses import JSONResponse
@@ -143,63 +257,44 @@ async def handle_speech_to_text(file: UploadFile):
             content={"error": "Google API key not configured"}
         )
 
-    # Create data directory if it doesn't exist
-    os.makedirs("data", exist_ok=True)
-    
-    # Save the uploaded file temporarily
-    webm_path = os.path.join("data", f"temp_{uuid.uuid4().hex}.webm")
-    wav_path = os.path.join("data", f"temp_{uuid.uuid4().hex}.wav")
-    
     try:
         # Read the uploaded file
         logger.debug("Reading uploaded file")
         content = await file.read()
-        with open(webm_path, "wb") as f:
-            f.write(content)
-        logger.debug(f"Saved WebM file to {webm_path}")
         
-        # Convert the WebM file to WAV format
-        logger.debug("Converting WebM to WAV")
+        # Convert the WebM audio to raw 16kHz mono PCM entirely in memory via ffmpeg pipes
+        logger.debug("Converting WebM to LINEAR16 PCM")
         try:
-            result = subprocess.run([
-                'ffmpeg', '-i', webm_path, 
+            result = await asyncio.to_thread(subprocess.run, [
+                'ffmpeg', '-i', 'pipe:0', 
                 '-acodec', 'pcm_s16le', 
                 '-ar', '16000', 
                 '-ac', '1', 
-                wav_path
-            ], check=True, capture_output=True, text=True)
-            logger.debug(f"FFmpeg output: {result.stdout}")
-            logger.debug(f"FFmpeg errors: {result.stderr}")
+                '-f', 's16le',
+                'pipe:1'
+            ], input=content, check=True, capture_output=True)
+            logger.debug(f"FFmpeg errors: {result.stderr.decode(errors='replace')}")
         except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode(errors='replace')
             logger.error(f"FFmpeg conversion failed: {str(e)}")
-            logger.error(f"FFmpeg stderr: {e.stderr}")
+            logger.error(f"FFmpeg stderr: {stderr}")
             return JSONResponse(
                 status_code=500,
-                content={"error": f"FFmpeg conversion failed: {e.stderr}"}
+                content={"error": f"FFmpeg conversion failed: {stderr}"}
             )
 
-        # Verify WAV file exists and has content
-        if not os.path.exists(wav_path):
-            logger.error("WAV file was not created")
-            return JSONResponse(
-                status_code=500,
-                content={"error": "WAV file conversion failed"}
-            )
-            
-        wav_size = os.path.getsize(wav_path)
-        logger.debug(f"WAV file size: {wav_size} bytes")
+        pcm_size = len(result.stdout)
+        logger.debug(f"PCM audio size: {pcm_size} bytes")
         
-        if wav_size == 0:
-            logger.error("WAV file is empty")
+        if pcm_size == 0:
+            logger.error("Converted audio is empty")
             return JSONResponse(
                 status_code=500,
-                content={"error": "Converted WAV file is empty"}
+                content={"error": "Converted audio is empty"}
             )
 
-        # Read the WAV file and encode it to base64
-        logger.debug("Reading and encoding WAV file")
-        with open(wav_path, "rb") as audio_file:
-            audio_content = base64.b64encode(audio_file.read()).decode('utf-8')
+        # Encode the PCM audio to base64
+        audio_content = base64.b64encode(result.stdout).decode('utf-8')
 
         # Prepare the request payload
         payload = {
@@ -216,31 +311,30 @@ async def handle_speech_to_text(file: UploadFile):
 
         # Make request to Google Cloud Speech-to-Text API
         logger.debug("Making request to Google Cloud API")
-        async with aiohttp.ClientSession() as session:
-            url = f"https://speech.googleapis.com/v1/speech:recognize?key={api_key}"
-            async with session.post(url, json=payload) as response:
-                response_text = await response.text()
-                logger.debug(f"API Response status: {response.status}")
-                logger.debug(f"API Response: {response_text}")
-                
-                if response.status != 200:
-                    logger.error(f"API request failed with status {response.status}: {response_text}")
-                    return JSONResponse(
-                        status_code=response.status,
-                        content={"error": f"API request failed: {response_text}"}
-                    )
-                
-                result = json.loads(response_text)
-                
-                # Extract the transcribed text
-                transcript = ""
-                if "results" in result:
-                    for result_item in result["results"]:
-                        if "alternatives" in result_item and result_item["alternatives"]:
-                            transcript += result_item["alternatives"][0]["transcript"]
-                
-                logger.info("Successfully transcribed audio")
-                return {"status": "success", "text": transcript}
+        url = f"https://speech.googleapis.com/v1/speech:recognize?key={api_key}"
+        response = await http_client.post(url, json=payload)
+        response_text = response.text
+        logger.debug(f"API Response status: {response.status_code}")
+        logger.debug(f"API Response: {response_text}")
+        
+        if response.status_code != 200:
+            logger.error(f"API request failed with status {response.status_code}: {response_text}")
+            return JSONResponse(
+                status_code=response.status_code,
+                content={"error": f"API request failed: {response_text}"}
+            )
+        
+        result = json.loads(response_text)
+        
+        # Extract the transcribed text
+        transcript = ""
+        if "results" in result:
+            for result_item in result["results"]:
+                if "alternatives" in result_item and result_item["alternatives"]:
+                    transcript += result_item["alternatives"][0]["transcript"]
+        
+        logger.info("Successfully transcribed audio")
+        return {"status": "success", "text": transcript}
 
     except Exception as e:
         logger.exception("Unexpected error occurred")
@@ -248,16 +342,86 @@ async def handle_speech_to_text(file: UploadFile):
             status_code=500,
             content={"error": f"An error occurred during transcription: {str(e)}"}
         )
-    
-    finally:
-        # Clean up temporary files
-        logger.debug("Cleaning up temporary files")
-        if os.path.exists(webm_path):
-            os.remove(webm_path)
-            logger.debug(f"Removed {webm_path}")
-        if os.path.exists(wav_path):
-            os.remove(wav_path)
-            logger.debug(f"Removed {wav_path}")
+
+class CachedQueryEmbeddings(HuggingFaceEmbeddings):
+    """HuggingFaceEmbeddings that memoizes embed_query, so repeated questions skip the encoder"""
+
+    def __hash__(self):
+        return id(self)
+
+    def embed_query(self, text: str):
+        return list(_cached_query_embedding(self, text))
+
+@lru_cache(maxsize=2048)
+def _cached_query_embedding(embeddings: CachedQueryEmbeddings, text: str):
+    return tuple(HuggingFaceEmbeddings.embed_query(embeddings, text))
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    # One shared instance, loaded on first use so PDF worker processes never load the model
+    model_kwargs = {'device': 'cpu'}
+    encode_kwargs = {'normalize_embeddings': True, 'batch_size': EMBEDDING_BATCH_SIZE}
+    return CachedQueryEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs=model_kwargs,
+        encode_kwargs=encode_kwargs
+    )
+
+def get_index_key(pdf_paths) -> str:
+    """Fingerprint of the PDF sources and chunking settings the saved index was built from"""
+    hasher = hashlib.sha256()
+    for path in pdf_paths:
+        try:
+            stat = os.stat(path)
+            hasher.update(f"{path}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+        except OSError:
+            hasher.update(f"{path}|missing".encode())
+    hasher.update(f"{CHUNK_SIZE}|{CHUNK_OVERLAP}|{EMBEDDING_MODEL}".encode())
+    hasher.update(f"sq8|{HNSW_M}|{HNSW_EF_SEARCH}|{IVF_NLIST}|{IVF_NPROBE}".encode())
+    return hasher.hexdigest()
+
+def build_faiss_index(vectors):
+    vecs = np.array(vectors, dtype='float32')
+    d = vecs.shape[1]
+    # Vectors are stored as 8-bit scalar-quantized codes: 4x smaller than float32
+    # and scanned with FAISS's SIMD int8 distance kernels
+    # FAISS wants roughly 39 training points per IVF centroid
+    if len(vecs) >= 39 * IVF_NLIST:
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFScalarQuantizer(quantizer, d, IVF_NLIST, faiss.ScalarQuantizer.QT_8bit)
+        index.nprobe = IVF_NPROBE
+    else:
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(vecs)
+    index.add(vecs)
+    return index
+
+def build_vectorstore(text_chunks, vectors, embeddings):
+    doc_ids = [str(uuid.uuid4()) for _ in text_chunks]
+    return FAISS(
+        embedding_function=embeddings,
+        index=build_faiss_index(vectors),
+        docstore=InMemoryDocstore({
+            doc_id: Document(page_content=text)
+            for doc_id, text in zip(doc_ids, text_chunks)
+        }),
+        index_to_docstore_id=dict(enumerate(doc_ids))
+    )
+
+def load_saved_vectorstore(index_key: str):
+    try:
+        with open(FAISS_META_PATH, "r", encoding="utf-8") as f:
+            if json.load(f).get('key') != index_key:
+                return None
+        return FAISS.load_local(
+            FAISS_INDEX_PATH,
+            get_embeddings(),
+            allow_dangerous_deserialization=True
+        )
+    except Exception as e:
+        logger.warning(f"Saved vectorstore not usable, rebuilding: {e}")
+        return None
 
 def initialize_global_vectorstore():
     global global_vectorstore
@@ -272,138 +436,110 @@ def initialize_global_vectorstore():
             os.path.join('data', "website-data-ik.pdf")
         ]
 
-        combined_text = ""
-        for path in pdf_paths:
-            combined_text += get_pdf_text(path) + " "
+        index_key = get_index_key(pdf_paths)
+        global_vectorstore = load_saved_vectorstore(index_key)
+        if global_vectorstore is not None:
+            logger.info("Vectorstore loaded from disk.")
+            return True, "[SYSTEM MESSAGE] Vectorstore was loaded from disk."
+
+        # Text extraction is CPU-bound, so parse and chunk each PDF in its own process;
+        # only chunk lists come back, never one combined text of every PDF
+        text_chunks = []
+        with ProcessPoolExecutor(max_workers=min(4, len(pdf_paths))) as pool:
+            for chunks in pool.map(_extract_pdf_chunks, pdf_paths):
+                text_chunks.extend(chunks)
 
-        if not combined_text.strip():
+        if not text_chunks:
             return False, "No text could be extracted from the PDFs."
-
-        text_chunks = get_text_chunks(combined_text)
         
         # Initialize the embedding model
-        model_kwargs = {'device': 'cpu'}
-        encode_kwargs = {'normalize_embeddings': True}
-        embeddings = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL,
-            model_kwargs=model_kwargs,
-            encode_kwargs=encode_kwargs
-        )
+        embeddings = get_embeddings()
         
-        global_vectorstore = FAISS.from_texts(
-            texts=text_chunks,
-            embedding=embeddings
-        )
+        # Encode every chunk in one batched call, then build the index from the vectors
+        vectors = embeddings.embed_documents(text_chunks)
+        global_vectorstore = build_vectorstore(text_chunks, vectors, embeddings)
         logger.info("Vectorstore has been created with SentenceTransformers embeddings.")
+
+        global_vectorstore.save_local(FAISS_INDEX_PATH)
+        with open(FAISS_META_PATH, "w", encoding="utf-8") as f:
+            json.dump({'key': index_key}, f)
     return True, "[SYSTEM MESSAGE] Vectorstore was created successfully."
 
-def handle_userinput(user_question: str, user_id: str):
+class TokenQueueHandler(AsyncCallbackHandler):
+    """Collects streamed LLM tokens into a queue for a streaming response"""
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.queue.put_nowait(token)
+
+async def handle_userinput(user_question: str, user_id: str, callbacks=None):
     user_state = get_user_state(user_id)
     conversation_chain = user_state['chain']
     if not conversation_chain:
         return None
 
-    # Step 1: Define the refinement template
-    def refine_input(input_text):
-        refinement_prompt = f"""
-        The user provided the following input: "{input_text}"
-
-
-        Context: The input may contain minor errors or variations due to inaccuracies in communication or understanding. something as huge as ehiglo considered as ethical law or igloo or tigloo so be lineant
-        Your task is to:
-        1. Interpret the user's intent.
-        2. Refine the input to make it coherent and meaningful.
-        3. Provide the refined version.
-
-        
-
-        You are trained specifically about UBIK Solutions. Follow this exact decision tree when responding:
-
-        1. First, check if the question has any relevant context in the provided knowledge base:
-           - If you find context even with misspelled words → Proceed with answering
-
-        2. If no direct context match but the question seems relevant:
-           - If unclear word might affect the answer → Ask for spelling playfully
-           - Example: "Oh! I'd love to help with that! Could you spell out [unclear word]? Just want to make sure I give you the perfect answer! 😊"
-           
-        3. If the question seems relevant but unclear word isn't crucial:
-           - Proceed with answering based on best interpretation
-           - Example: Small grammatical errors or common word variations
-
-        4. If the question is completely irrelevant and u get no context along:
-           - Politely respond: "I'm specifically trained to help with questions about UBIK Solutions. This seems outside my expertise!"
-
-
-
-           Refined Input:
-        """
-        return conversation_chain({'question': refinement_prompt})['answer'].strip()
-
-    # Step 2: Generate the answer using the refined input
-    def generate_answer(refined_input):
-        answer_prompt = f"""
-        User's Refined Input: "{refined_input}"
-
-        Context: Respond to the user's query based on the refined input in a clear, concise, and contextually relevant manner.
-
-        Answer:
-        """
-        return conversation_chain({'question': answer_prompt})['answer'].strip()
-
-    # Step 3: Refine the user input
-    refined_question = refine_input(user_question)
-    log_event("RefinedInput", f"Refined Question: {refined_question}", user_id=user_id)
-
-    # Step 4: Generate the final answer
-    answer = generate_answer(refined_question)
+    # The question goes to the chain as-is: its condense step already rewrites
+    # follow-ups, and the model copes with speech-recognition typos on its own
+    result = await conversation_chain.ainvoke(
+        {'question': user_question},
+        config={'callbacks': callbacks}
+    )
+    answer = result['answer'].strip()
 
-    # Step 5: Log events and update history
+    # Log events and update history
     user_state['history'].append((user_question, answer))
-    log_event("PromptSentToGPT", f"Original Prompt: {user_question}, Refined: {refined_question}", user_id=user_id)
+    log_event("PromptSentToGPT", f"Prompt: {user_question}", user_id=user_id)
     log_event("UserQuestion", f"Q: {user_question}", user_id=user_id)
     log_event("AIAnswer", f"A: {answer}", user_id=user_id)
 
     return {'text': answer}
 
-def create_or_refresh_user_chain(user_id: str):
-    user_state = get_user_state(user_id)
-    if user_state['chain'] is None:
-        if global_vectorstore is None:
-            return False, "Global vectorstore is not initialized."
-
-        # Create chat model with system message
-        chat_llm = ChatOpenAI(model=MODEL_NAME, temperature=0.9)
+# Chat models are stateless per call, so every user's chain shares the same clients
+SHARED_CHAT_LLM = ChatOpenAI(model=MODEL_NAME, temperature=0.9, streaming=True)
+# Non-streaming, so only the answer step emits tokens to /ask/stream
+SHARED_CONDENSE_LLM = ChatOpenAI(model=MODEL_NAME, temperature=0.9)
 
-        # Create custom QA prompt template that includes system message
-        condense_template = """Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
+# Prompt templates are built once and shared by every user's chain
+condense_template = """Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
 
         Chat History:
         {chat_history}
         Follow Up Input: {question}
         Standalone question:"""
-        CONDENSE_QUESTION_PROMPT = PromptTemplate.from_template(condense_template)
+CONDENSE_QUESTION_PROMPT = PromptTemplate.from_template(condense_template)
 
-        qa_template = f"""
-        {user_state['system_message']}
+@lru_cache(maxsize=64)
+def get_qa_prompt(system_message: str) -> PromptTemplate:
+    # Custom QA prompt template that includes system message
+    qa_template = f"""
+        {system_message}
 
         Context: {{context}}
         
         Question: {{question}}
         
         Answer: """
-        
-        QA_PROMPT = PromptTemplate(
-            template=qa_template,
-            input_variables=["context", "question"]
-        )
+    
+    return PromptTemplate(
+        template=qa_template,
+        input_variables=["context", "question"]
+    )
+
+def create_or_refresh_user_chain(user_id: str):
+    user_state = get_user_state(user_id)
+    if user_state['chain'] is None:
+        if global_vectorstore is None:
+            return False, "Global vectorstore is not initialized."
 
         # Create the chain
         user_state['chain'] = ConversationalRetrievalChain.from_llm(
-            llm=chat_llm,
+            llm=SHARED_CHAT_LLM,
+            condense_question_llm=SHARED_CONDENSE_LLM,
             retriever=global_vectorstore.as_retriever(),
             memory=user_state['memory'],
             condense_question_prompt=CONDENSE_QUESTION_PROMPT,
-            combine_docs_chain_kwargs={'prompt': QA_PROMPT}
+            combine_docs_chain_kwargs={'prompt': get_qa_prompt(user_state['system_message'])}
         )
         
         logger.info(f"New conversation chain created for user {user_id} with system message: {user_state['system_message']}")
@@ -414,12 +550,23 @@ def create_or_refresh_user_chain(user_id: str):
 
 @app.on_event("startup")
 async def startup_event():
+    global log_writer_task
+    log_writer_task = asyncio.create_task(write_log_events())
     success, message = initialize_global_vectorstore()
     if not success:
         logger.error(f"Failed to initialize vectorstore: {message}")
     else:
         logger.info("Vectorstore initialized successfully on startup")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await http_client.aclose()
+    if log_writer_task is not None:
+        log_writer_task.cancel()
+    lines = _drain_log_queue([])
+    if lines:
+        _append_log_lines(lines)
+
 @app.get("/")
 async def hello_root():
     return {
@@ -441,6 +588,24 @@ async def refresh_chain(request: Request):
     status = 'success' if success else 'error'
     return {"status": status, "message": message}
 
+async def forward_answer(forward_endpoint: str, text: str) -> str:
+    try:
+        # Format payload to match ReceiveText model
+        payload = {
+            "text": text  # Just send the text field as expected by ReceiveText
+        }
+
+        forward_response = await http_client.post(forward_endpoint, json=payload)
+        if forward_response.status_code != 200:
+            logger.error(f"Forward request failed with status {forward_response.status_code}: {forward_response.text}")
+            return "failed"
+        logger.info("Response forwarding success")
+        return "success"
+
+    except Exception as e:
+        logger.error(f"Error forwarding response: {e}")
+        return "failed"
+
 @app.post("/ask")
 async def ask_question(request: Request):
     try:
@@ -458,28 +623,21 @@ async def ask_question(request: Request):
     if user_id not in user_sessions or user_sessions[user_id]['chain'] is None:
         create_or_refresh_user_chain(user_id)
 
-    answer = handle_userinput(user_question, user_id)
-    if not answer:
-        return {"status": "error", "message": "No conversation chain or unable to handle question."}
+    cache_key = (user_id, get_user_state(user_id)['system_message'], user_question.strip().lower())
+    answer = answer_cache.get(cache_key)
+    cached = answer is not None
+    if cached:
+        log_event("CachedAnswer", f"Q: {user_question}", user_id=user_id)
+    else:
+        answer = await handle_userinput(user_question, user_id)
+        if not answer:
+            return {"status": "error", "message": "No conversation chain or unable to handle question."}
+        answer_cache[cache_key] = answer
 
-    # Forward the response to the endpoint
-    try:
-        # Format payload to match ReceiveText model
-        payload = {
-            "text": answer['text']  # Just send the text field as expected by ReceiveText
-        }
-        
-        forward_response = requests.post(FORWARD_ENDPOINT, json=payload)
-        forwarding_status = "success" if forward_response.status_code == 200 else "failed"
-        
-        if forward_response.status_code != 200:
-            logger.error(f"Forward request failed with status {forward_response.status_code}: {forward_response.text}")
-        else:
-            logger.info(f"Response forwarding {forwarding_status}")
-            
-    except Exception as e:
-        logger.error(f"Error forwarding response: {e}")
-        forwarding_status = "failed"
+    # Forward the response to the endpoint; its status is part of the reply
+    forwarding_status = "skipped"
+    if not cached or FORWARD_CACHED_ANSWERS:
+        forwarding_status = await forward_answer(FORWARD_ENDPOINT, answer['text'])
 
     prompt_sent = {'question': user_question}
     return {
@@ -489,6 +647,71 @@ async def ask_question(request: Request):
         "forwarding_status": forwarding_status
     }
 
+@app.post("/ask/stream")
+async def ask_question_stream(request: Request):
+    """Server-sent events variant of /ask that streams answer tokens as they are generated"""
+    try:
+        data = await request.json()
+    except:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON payload."})
+
+    if "user_id" not in data or "question" not in data:
+        return JSONResponse(status_code=400, content={"error": "Missing user_id or question."})
+
+    user_id = data["user_id"]
+    user_question = data["question"]
+    FORWARD_ENDPOINT = os.getenv("FORWARD_ENDPOINT", "https://d07f-157-119-42-46.ngrok-free.app/receive")
+
+    if user_id not in user_sessions or user_sessions[user_id]['chain'] is None:
+        create_or_refresh_user_chain(user_id)
+    if user_sessions[user_id]['chain'] is None:
+        return {"status": "error", "message": "No conversation chain or unable to handle question."}
+
+    async def forward_windows(windows: asyncio.Queue):
+        # Forward windows one at a time so the receiver gets them in order
+        statuses = []
+        while (window := await windows.get()) is not None:
+            statuses.append(await forward_answer(FORWARD_ENDPOINT, window))
+        return "success" if statuses and all(s == "success" for s in statuses) else "failed"
+
+    async def event_stream():
+        handler = TokenQueueHandler()
+        task = asyncio.create_task(handle_userinput(user_question, user_id, callbacks=[handler]))
+        task.add_done_callback(lambda _: handler.queue.put_nowait(None))
+        windows: asyncio.Queue = asyncio.Queue()
+        forwarder = asyncio.create_task(forward_windows(windows))
+
+        try:
+            window = ""
+            while (token := await handler.queue.get()) is not None:
+                window += token
+                if len(window) >= FORWARD_WINDOW_CHARS:
+                    windows.put_nowait(window)
+                    window = ""
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            if window.strip():
+                windows.put_nowait(window)
+            windows.put_nowait(None)
+
+            try:
+                answer = await task
+            except Exception as e:
+                logger.error(f"Error streaming answer: {e}")
+                answer = None
+            forwarding_status = await forwarder
+        finally:
+            # A client disconnect closes the generator mid-loop; never leave either task orphaned
+            windows.put_nowait(None)
+            for pending in (task, forwarder):
+                if not pending.done():
+                    pending.cancel()
+        if not answer:
+            yield f"event: error\ndata: {json.dumps({'message': 'Unable to handle question.'})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'data': answer, 'prompt': {'question': user_question}, 'forwarding_status': forwarding_status})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/set_system_message")
 async def set_system_message(request: Request):
     try:
@@ -509,6 +732,7 @@ async def set_system_message(request: Request):
     user_state['system_message'] = system_message
     # Force recreation of chain with new system message
     user_state['chain'] = None
+    answer_cache.discard_where(lambda key: key[0] == user_id)
     
     success, message = create_or_refresh_user_chain(user_id)
     
@@ -548,6 +772,8 @@ async def clear_history(request: Request):
     if not user_id:
         return JSONResponse(status_code=400, content={"error": "Missing user_id."})
 
+    # Cached answers would otherwise bypass the fresh history for another ANSWER_CACHE_TTL
+    answer_cache.discard_where(lambda key: key[0] == user_id)
     if user_id in user_sessions:
         user_state = user_sessions[user_id]
         user_state['memory'].clear()
@@ -573,6 +799,7 @@ async def logout(request: Request):
     if not user_id:
         return JSONResponse(status_code=400, content={"error": "Missing user_id."})
 
+    answer_cache.discard_where(lambda key: key[0] == user_id)
     if user_id in user_sessions:
         del user_sessions[user_id]
     return {"status": "success", "message": "User session cleared."}
@@ -583,6 +810,15 @@ async def logout(request: Request):
 # ------------------------------------------------------------------------
 
 GOOGLE_TTS_API_KEY = os.getenv("GOOGLE_TTS_API_KEY")  # Load your API key from .env or environment variable
+TTS_CACHE_DIR = os.path.join("data", "tts_cache")
+
+def _write_audio_file(audio_path: str, audio_bytes: bytes):
+    # Write then rename so a concurrent request never serves a half-written file
+    os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+    tmp_path = f"{audio_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as audio_file:
+        audio_file.write(audio_bytes)
+    os.replace(tmp_path, audio_path)
 
 @app.post("/text_to_speech")
 async def text_to_speech_api(request: Request):
@@ -602,6 +838,14 @@ async def text_to_speech_api(request: Request):
                 content={"error": "Missing 'text' in request."}
             )
 
+        # Identical synthesis requests reuse the MP3 produced the first time
+        cache_key = hashlib.sha256(
+            f"{text}|{voice_name}|{language_code}|{speaking_rate}".encode("utf-8")
+        ).hexdigest()
+        audio_path = os.path.join(TTS_CACHE_DIR, f"{cache_key}.mp3")
+        if os.path.exists(audio_path):
+            return {"status": "success", "audio_url": audio_path}
+
         # Google TTS API endpoint with API key
         url = "https://texttospeech.googleapis.com/v1/text:synthesize?key=" + GOOGLE_TTS_API_KEY
 
@@ -619,7 +863,7 @@ async def text_to_speech_api(request: Request):
         }
 
         # Make request to the Google TTS API
-        response = requests.post(url, json=payload)
+        response = await http_client.post(url, json=payload)
 
         if response.status_code == 200:
             audio_content = response.json().get("audioContent", None)
@@ -629,10 +873,8 @@ async def text_to_speech_api(request: Request):
                     content={"error": "No audio content received from TTS API."}
                 )
 
-            # Decode the base64 audio content and save it
-            audio_path = os.path.join("data", f"tts_output_{uuid.uuid4().hex}.mp3")
-            with open(audio_path, "wb") as audio_file:
-                audio_file.write(base64.b64decode(audio_content))
+            # Decode the base64 audio content and save it under its cache key
+            await asyncio.to_thread(_write_audio_file, audio_path, base64.b64decode(audio_content))
 
             # Return path or URL to the generated audio
             return {"status": "success", "audio_url": audio_path}